@@ -0,0 +1,332 @@
+# Author: Shuvam Raj Satyal
+
+# Reproducible indexing and query benchmark on a synthetic corpus.
+# Usage: python Benchmark.py <work directory> [options]
+
+import argparse
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import pickle
+import random
+import resource
+import sys
+import time
+from contextlib import redirect_stdout
+from shutil import rmtree
+
+import Build_Index
+import Search_Engine
+from Posting_Prefetcher import Posting_Prefetcher
+from Build_Index import BuildPartialInvertedIndexes, BuildAnchorIndex, BinaryMerge, extractFinalIndex, BuildMetaIndex, BuildSuggester
+from Inverted_Index import get_document_paths
+from Query_Profiler import get_percentile
+from nltk.stem import snowball
+
+BENCHMARK_DOCUMENTS = 2000
+DOCUMENTS_PER_DIRECTORY = 500 # Mirrors the {domain directory}/{document}.json corpus layout
+VOCABULARY_SIZE = 20000
+ZIPF_EXPONENT = 1.0 # s in P(rank k) ~ 1/k^s, close to what natural language text shows
+DOCUMENT_LENGTH = (100, 1500) # Min and max number of body terms per document
+LINKS_PER_DOCUMENT = 5
+QUERY_COUNT = 200
+QUERY_LENGTH = (1, 3) # Min and max number of terms per query
+RANDOM_SEED = 42
+
+SYLLABLES = [c + v for c in "bcdfghjklmnprstvwz" for v in "aeiou"]
+
+
+def generate_vocabulary(rng, vocabulary_size):
+	# Returns vocabulary_size distinct made-up alphabetic words.
+	# Index 0 is the most frequent word under the Zipfian distribution.
+	vocabulary = []
+	seen = set()
+	while len(vocabulary) < vocabulary_size:
+		word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+		if word not in seen:
+			seen.add(word)
+			vocabulary.append(word)
+	return vocabulary
+
+
+def get_zipf_cum_weights(vocabulary_size, exponent):
+	return list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, vocabulary_size + 1)))
+
+
+def sample_terms(rng, vocabulary, cum_weights, k):
+	return rng.choices(vocabulary, cum_weights=cum_weights, k=k)
+
+
+def generate_synthetic_corpus(corpus_path, num_documents, vocabulary, cum_weights, rng):
+	# Writes num_documents JSON files with the same {url, content, encoding} layout as the crawl.
+	# Pages have a title, headings, bold text and links to other synthetic pages, so field
+	# and anchor text indexing is exercised as well.
+
+	urls = [f"https://www.site{docid // DOCUMENTS_PER_DIRECTORY}.example.com/page{docid}.html" for docid in range(num_documents)]
+
+	for docid, url in enumerate(urls):
+		directory_path = os.path.join(corpus_path, f"www_site{docid // DOCUMENTS_PER_DIRECTORY}_example_com")
+		if not os.path.exists(directory_path): os.makedirs(directory_path)
+
+		body_terms = sample_terms(rng, vocabulary, cum_weights, rng.randint(*DOCUMENT_LENGTH))
+		title = ' '.join(sample_terms(rng, vocabulary, cum_weights, 4))
+		heading = ' '.join(sample_terms(rng, vocabulary, cum_weights, 3))
+		bold = ' '.join(sample_terms(rng, vocabulary, cum_weights, 2))
+		links = ''.join(f'<a href="{rng.choice(urls)}">{" ".join(sample_terms(rng, vocabulary, cum_weights, 2))}</a> ' for _ in range(LINKS_PER_DOCUMENT))
+
+		content = f"<html><head><title>{title}</title></head><body><h1>{heading}</h1>"\
+		f"<p><b>{bold}</b> {' '.join(body_terms)}</p><p>{links}</p></body></html>"
+
+		with open(os.path.join(directory_path, f"{docid}.json"), 'w') as fh:
+			json.dump({"url": url, "content": content, "encoding": "utf-8"}, fh)
+
+
+def generate_query_mix(rng, vocabulary, cum_weights, query_count):
+	# Queries follow the same Zipfian distribution as the corpus, so frequent terms
+	# (long posting lists) dominate just like they do in real query logs.
+	return [' '.join(sample_terms(rng, vocabulary, cum_weights, rng.randint(*QUERY_LENGTH))) for _ in range(query_count)]
+
+
+def get_peak_rss_bytes():
+	# ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+	peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def count_postings(inv_index_path):
+	posting_count = 0
+	with open(inv_index_path, 'r') as fh:
+		for line in fh:
+			posting_count += line.count("Posting(")
+	return posting_count
+
+
+def run_stage_process(connection, function, args, kwargs):
+	# Runs one build stage in a child process and sends back (result, wall time, peak RSS, exception)
+	try:
+		start_time = time.perf_counter()
+		with redirect_stdout(io.StringIO()):
+			result = function(*args, **kwargs)
+		connection.send((result, time.perf_counter() - start_time, get_peak_rss_bytes(), None))
+	except Exception as e:
+		connection.send((None, 0, 0, e))
+	connection.close()
+
+
+def run_stage(results, stage, function, *args, **kwargs):
+	# Runs one build stage with its progress output silenced and records wall time and peak RSS.
+	# ru_maxrss never goes down within a process, so each stage runs in its own forked process
+	# to keep its peak RSS from including the peaks of the stages before it.
+	# A forked process starts at the benchmark's own RSS, which is included in every stage's peak.
+
+	context = multiprocessing.get_context("fork")
+	parent_connection, child_connection = context.Pipe(duplex=False)
+	process = context.Process(target=run_stage_process, args=(child_connection, function, args, kwargs))
+	process.start()
+	child_connection.close()
+	result, elapsed, peak_rss_bytes, error = parent_connection.recv()
+	process.join()
+	if error is not None: raise error
+
+	results["stages"][stage] = {"seconds": elapsed, "peak_rss_bytes": peak_rss_bytes}
+	print(f"{stage:<28}{elapsed:>10.3f} s   peak RSS {peak_rss_bytes / 1000000:>9.1f} MB")
+	return result
+
+
+def evict_page_cache(path):
+	# Asks the OS to drop the cached pages of path so the next reads go to disk.
+	# Returns False where this isn't supported (posix_fadvise is Linux/Unix only).
+	if not hasattr(os, "posix_fadvise"): return False
+	with open(path, 'rb') as fh:
+		os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+	return True
+
+
+def run_query_mix(queries, inv_index_path, meta_index_path, doc_index_path, prefetch=False, cold_cache=False):
+	# Replays queries through the same boolean search, scoring and ranking path as Search_Engine.main,
+	# bypassing the search cache. Returns per-query latencies in nanoseconds.
+	# prefetch reads each query's posting lists concurrently through a Posting_Prefetcher.
+	# cold_cache evicts the inverted index from the OS page cache before every query.
+
+	stemmer = snowball.SnowballStemmer('english')
+	with open(meta_index_path, 'r') as fh:
+		Search_Engine.MetaIndex = json.load(fh)
+	with open(doc_index_path, 'r') as fh:
+		N = len(json.load(fh))
+
+	latencies = []
+	Search_Engine.PREFETCHER = Posting_Prefetcher(inv_index_path) if prefetch else None
+	with open(inv_index_path, 'r') as InvIndex_fh:
+		Search_Engine.InvIndex_fh = InvIndex_fh
+		for query in queries:
+			if cold_cache: evict_page_cache(inv_index_path)
+			start_time = time.perf_counter_ns()
+			query_iterator, stemmed_query_words = Search_Engine.get_query_iterator(query, N, stemmer)
+			booleanSearchData = next(Search_Engine.generate_boolean_search_data(query_iterator))
+			cosine_similarity = Search_Engine.compute_cosine_similarity(booleanSearchData, stemmed_query_words, N)
+			Search_Engine.rank(booleanSearchData, cosine_similarity)
+			latencies.append(time.perf_counter_ns() - start_time)
+
+	if Search_Engine.PREFETCHER is not None:
+		Search_Engine.PREFETCHER.close()
+		Search_Engine.PREFETCHER = None
+
+	return latencies
+
+
+def misspell(rng, word):
+	# Applies one random deletion, insertion, substitution or transposition to word
+	i = rng.randrange(len(word))
+	edit = rng.choice(["delete", "insert", "substitute", "transpose"])
+	if edit == "delete" and len(word) > 1: return word[:i] + word[i + 1:]
+	if edit == "insert": return word[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + word[i:]
+	if edit == "transpose" and i + 1 < len(word): return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+	return word[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + word[i + 1:]
+
+
+def run_suggestion_mix(rng, queries, suggester_path):
+	# Times Suggester.correct on misspelled query words and Suggester.complete on their prefixes.
+	# Returns (correction latencies, completion latencies, fraction of misspellings corrected to the original word).
+
+	with open(suggester_path, 'rb') as fh:
+		suggester = pickle.load(fh)
+
+	words = [word for query in queries for word in query.split()]
+	correction_latencies = []
+	completion_latencies = []
+	corrected = 0
+	for word in words:
+		misspelled_word = misspell(rng, word)
+		start_time = time.perf_counter_ns()
+		correction = suggester.correct(misspelled_word)
+		correction_latencies.append(time.perf_counter_ns() - start_time)
+		if correction == word: corrected += 1
+
+		prefix = word[:rng.randint(1, len(word))]
+		start_time = time.perf_counter_ns()
+		suggester.complete(prefix)
+		completion_latencies.append(time.perf_counter_ns() - start_time)
+
+	return correction_latencies, completion_latencies, corrected / len(words) if words else 0
+
+
+def main(work_dir_path, num_documents, num_queries, seed):
+	rng = random.Random(seed)
+	corpus_path = os.path.join(work_dir_path, "corpus")
+	storage_dir_path = os.path.join(work_dir_path, "index")
+	partial_indexes_dir_path = os.path.join(storage_dir_path, "Partial_Indexes")
+	merged_indexes_dir_path = os.path.join(storage_dir_path, "Merged_Indexes")
+	anchors_dir_path = os.path.join(storage_dir_path, "Anchors")
+	vocabulary_dir_path = os.path.join(storage_dir_path, "Vocabulary")
+	inv_index_name = "InvIndex.txt"
+	meta_index_name = "MetaIndex.json"
+	suggester_name = "Suggester.pkl"
+
+	# Start from a clean tree so runs are comparable
+	for path in [corpus_path, storage_dir_path]:
+		if os.path.exists(path): rmtree(path)
+	for path in [corpus_path, partial_indexes_dir_path, merged_indexes_dir_path, anchors_dir_path, vocabulary_dir_path]:
+		os.makedirs(path)
+
+	results = {
+		"config": {
+			"documents": num_documents,
+			"queries": num_queries,
+			"seed": seed,
+			"MEMORY_BUDGET": Build_Index.MEMORY_BUDGET,
+			"RESULT_BATCH_SIZE": Search_Engine.RESULT_BATCH_SIZE,
+		},
+		"stages": {},
+	}
+
+	vocabulary = generate_vocabulary(rng, VOCABULARY_SIZE)
+	cum_weights = get_zipf_cum_weights(VOCABULARY_SIZE, ZIPF_EXPONENT)
+
+	print(f"Generating {num_documents} synthetic documents in {corpus_path}")
+	generate_synthetic_corpus(corpus_path, num_documents, vocabulary, cum_weights, rng)
+	document_paths = get_document_paths(corpus_path)
+
+	results["flushes"] = run_stage(results, "BuildPartialInvertedIndexes", BuildPartialInvertedIndexes, document_paths, storage_dir_path, partial_indexes_dir_path, anchors_dir_path, vocabulary_dir_path)
+	run_stage(results, "BuildAnchorIndex", BuildAnchorIndex, storage_dir_path, partial_indexes_dir_path, anchors_dir_path)
+	run_stage(results, "BinaryMerge", BinaryMerge, partial_indexes_dir_path, merged_indexes_dir_path)
+	run_stage(results, "extractFinalIndex", extractFinalIndex, inv_index_name, storage_dir_path, partial_indexes_dir_path, merged_indexes_dir_path)
+	run_stage(results, "BuildMetaIndex", BuildMetaIndex, meta_index_name, inv_index_name, storage_dir_path)
+	run_stage(results, "BuildSuggester", BuildSuggester, suggester_name, storage_dir_path, vocabulary_dir_path)
+
+	inv_index_path = os.path.join(storage_dir_path, inv_index_name)
+	index_bytes = os.path.getsize(inv_index_path)
+	posting_count = count_postings(inv_index_path)
+	build_seconds = sum(stage["seconds"] for stage in results["stages"].values())
+
+	results["indexing"] = {
+		"docs_per_second": num_documents / results["stages"]["BuildPartialInvertedIndexes"]["seconds"],
+		"end_to_end_docs_per_second": num_documents / build_seconds,
+		"index_bytes": index_bytes,
+		"postings": posting_count,
+		"index_bytes_per_posting": index_bytes / posting_count if posting_count else 0,
+		"peak_rss_bytes": max(stage["peak_rss_bytes"] for stage in results["stages"].values()), # Of the largest stage
+	}
+
+	queries = generate_query_mix(rng, vocabulary, cum_weights, num_queries)
+	# Sequential reads on one file handle vs concurrent reads through Posting_Prefetcher,
+	# with the index in the page cache (warm) and evicted before every query (cold)
+	query_modes = [("sequential", "warm"), ("prefetch", "warm")]
+	if evict_page_cache(inv_index_path): query_modes += [("sequential", "cold"), ("prefetch", "cold")]
+	else: print("Page cache eviction is not supported on this platform, skipping cold cache runs")
+
+	results["queries"] = {}
+	for read_path, cache_state in query_modes:
+		latencies = sorted(run_query_mix(queries, inv_index_path, os.path.join(storage_dir_path, meta_index_name), os.path.join(storage_dir_path, "DocIndex.json"),
+		prefetch=read_path == "prefetch", cold_cache=cache_state == "cold"))
+		results["queries"][f"{read_path}_{cache_state}"] = {
+			"count": len(latencies),
+			"p50_ms": get_percentile(latencies, 50) / 1000000,
+			"p99_ms": get_percentile(latencies, 99) / 1000000,
+			"mean_ms": sum(latencies) / len(latencies) / 1000000 if latencies else 0,
+		}
+
+	correction_latencies, completion_latencies, correction_accuracy = run_suggestion_mix(rng, queries, os.path.join(storage_dir_path, suggester_name))
+	correction_latencies.sort()
+	completion_latencies.sort()
+	results["suggestions"] = {
+		"correction_p50_us": get_percentile(correction_latencies, 50) / 1000,
+		"correction_p99_us": get_percentile(correction_latencies, 99) / 1000,
+		"correction_accuracy": correction_accuracy,
+		"completion_p50_us": get_percentile(completion_latencies, 50) / 1000,
+		"completion_p99_us": get_percentile(completion_latencies, 99) / 1000,
+	}
+
+	print(f"\nIndexing: {results['indexing']['docs_per_second']:.1f} docs/sec (partial indexes), "\
+	f"{results['indexing']['end_to_end_docs_per_second']:.1f} docs/sec (end to end)")
+	print(f"Index: {index_bytes} bytes, {posting_count} postings, {results['indexing']['index_bytes_per_posting']:.1f} bytes/posting")
+	print(f"Peak RSS: {results['indexing']['peak_rss_bytes'] / 1000000:.1f} MB (largest build stage)")
+	print(f"Partial index flushes: {len(results['flushes'])} (memory budget {Build_Index.MEMORY_BUDGET / 1000000:.1f} MB)")
+	for query_mode, summary in results["queries"].items():
+		print(f"Queries ({query_mode}): p50 {summary['p50_ms']:.3f} ms, p99 {summary['p99_ms']:.3f} ms, mean {summary['mean_ms']:.3f} ms over {summary['count']} queries")
+	print(f"Spelling correction: p50 {results['suggestions']['correction_p50_us']:.1f} us, p99 {results['suggestions']['correction_p99_us']:.1f} us, "\
+	f"{results['suggestions']['correction_accuracy'] * 100:.1f}% restored")
+	print(f"Autocomplete: p50 {results['suggestions']['completion_p50_us']:.1f} us, p99 {results['suggestions']['completion_p99_us']:.1f} us")
+
+	with open(os.path.join(work_dir_path, "benchmark_results.json"), 'w') as fh:
+		json.dump(results, fh, indent=3)
+
+	return results
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark indexing and query latency on a synthetic Zipfian corpus.")
+	parser.add_argument("work_dir", help="Directory for the synthetic corpus, the index and benchmark_results.json")
+	parser.add_argument("--documents", type=int, default=BENCHMARK_DOCUMENTS)
+	parser.add_argument("--queries", type=int, default=QUERY_COUNT)
+	parser.add_argument("--seed", type=int, default=RANDOM_SEED)
+	parser.add_argument("--memory-budget", type=int, default=Build_Index.MEMORY_BUDGET, help="Indexer memory budget in bytes")
+	parser.add_argument("--result-batch-size", type=int, default=Search_Engine.RESULT_BATCH_SIZE)
+	args = parser.parse_args()
+
+	# The build and search modules read these at call time, so overriding them here is enough
+	Build_Index.MEMORY_BUDGET = args.memory_budget
+	Search_Engine.RESULT_BATCH_SIZE = args.result_batch_size
+
+	main(args.work_dir, args.documents, args.queries, args.seed)
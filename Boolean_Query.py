@@ -0,0 +1,319 @@
+# Author: Shuvam Raj Satyal
+
+# Boolean query language and lazy posting list iterators.
+#
+# Grammar (NOT binds tighter than AND, AND binds tighter than OR):
+#   or_expr  := and_expr ("OR" and_expr)*
+#   and_expr := adjacent ("AND" adjacent)*
+#   adjacent := not_expr not_expr*             adjacent terms are implicitly ANDed
+#   not_expr := "NOT" not_expr | primary
+#   primary  := "(" or_expr ")" | term
+#
+# Query trees are tuples: ("TERM", term), ("AND", [children]), ("IMPLICIT_AND", [children]),
+# ("OR", [children]), ("NOT", child). IMPLICIT_AND joins adjacent terms and matches like AND,
+# but unlike an AND the user typed it may be relaxed to OR by relax_query_tree().
+
+import re
+from Inverted_Index import PostingList
+
+QUERY_TOKEN_PATTERN = r"\(|\)|[a-zA-Z0-9]+"
+OPERATORS = {"AND", "OR", "NOT"}
+
+
+def parse_query(query):
+	# Parses query into a query tree. Operators must be upper case, so "and", "or" and "not"
+	# are searched for as ordinary words. Returns None for queries without any terms.
+	# Raises ValueError for malformed queries.
+
+	tokens = re.findall(QUERY_TOKEN_PATTERN, query)
+	position = 0
+
+	def peek():
+		return tokens[position] if position < len(tokens) else None
+
+	def consume():
+		nonlocal position
+		position += 1
+		return tokens[position - 1]
+
+	def parse_or():
+		children = [parse_and()]
+		while peek() == "OR":
+			consume()
+			children.append(parse_and())
+		return children[0] if len(children) == 1 else ("OR", children)
+
+	def parse_and():
+		groups = [[parse_not()]] # Runs of adjacent operands, separated by explicit ANDs
+		while peek() is not None and peek() not in {"OR", ")"}:
+			if peek() == "AND":
+				consume()
+				groups.append([])
+			groups[-1].append(parse_not())
+		groups = [group[0] if len(group) == 1 else ("IMPLICIT_AND", group) for group in groups]
+		return groups[0] if len(groups) == 1 else ("AND", groups)
+
+	def parse_not():
+		if peek() == "NOT":
+			consume()
+			return ("NOT", parse_not())
+		return parse_primary()
+
+	def parse_primary():
+		token = peek()
+		if token is None:
+			raise ValueError("Incomplete query: expected a term after an operator")
+		if token == "(":
+			consume()
+			child = parse_or()
+			if peek() != ")": raise ValueError("Unbalanced parentheses in query")
+			consume()
+			return child
+		if token in OPERATORS or token == ")":
+			raise ValueError(f"Unexpected '{token}' in query")
+		return ("TERM", consume())
+
+	if len(tokens) == 0: return None
+	query_tree = parse_or()
+	if peek() is not None: raise ValueError(f"Unexpected '{peek()}' in query")
+	return query_tree
+
+
+def get_query_words(query_tree):
+	# Returns the words of all TERM nodes, including negated ones
+	if query_tree is None: return []
+	if query_tree[0] == "TERM": return [query_tree[1]]
+	if query_tree[0] == "NOT": return get_query_words(query_tree[1])
+	return [word for child in query_tree[1] for word in get_query_words(child)]
+
+
+def get_positive_terms(query_tree):
+	# Returns the terms a matching document may contain, i.e. those not under a NOT
+	if query_tree is None or query_tree[0] == "NOT": return []
+	if query_tree[0] == "TERM": return [query_tree[1]]
+	return [term for child in query_tree[1] for term in get_positive_terms(child)]
+
+
+def normalize_query_tree(query_tree, stemmer, stop_words):
+	# Stems every term and removes stop words, unless the query only contains stop words
+	# like "to be or not to be". Operators left without operands are removed as well.
+
+	keep_stop_words = all(word.lower() in stop_words for word in get_query_words(query_tree))
+
+	def normalize(node):
+		if node[0] == "TERM":
+			if not keep_stop_words and node[1].lower() in stop_words: return None
+			return ("TERM", stemmer.stem(node[1]))
+		if node[0] == "NOT":
+			child = normalize(node[1])
+			return None if child is None else ("NOT", child)
+		children = [child for child in map(normalize, node[1]) if child is not None]
+		if len(children) == 0: return None
+		return children[0] if len(children) == 1 else (node[0], children)
+
+	return None if query_tree is None else normalize(query_tree)
+
+
+def relax_query_tree(query_tree):
+	# Returns query_tree with the positive operands of every implicit AND ORed instead.
+	# Negated operands still exclude documents, and explicit ANDs and NOTs are kept as they are,
+	# so "python NOT snake" never matches documents without "python".
+
+	if query_tree is None or query_tree[0] in {"TERM", "NOT"}: return query_tree
+
+	children = [relax_query_tree(child) for child in query_tree[1]]
+	if query_tree[0] != "IMPLICIT_AND": return (query_tree[0], children)
+
+	include = [child for child in children if child[0] != "NOT"]
+	exclude = [child for child in children if child[0] == "NOT"]
+	if len(include) <= 1: return (query_tree[0], children)
+
+	relaxed_include = ("OR", include)
+	return relaxed_include if len(exclude) == 0 else ("AND", [relaxed_include] + exclude)
+
+
+class Posting_Iterator:
+	# Iterates over the postings of one term in docid order.
+	# postings must be an iterator of Posting objects sorted by docid.
+	def __init__(self, term, postings, df):
+		self.term = term
+		self.cost = df
+		self.__df = df
+		self.__postings = postings
+		self.docid = None # None once the iterator is exhausted
+		self.posting = None
+		self.next()
+
+	def next(self):
+		# BinaryMerge leaves at most one posting per docid for each term
+		for posting in self.__postings:
+			self.docid = posting.docid
+			self.posting = posting
+			return
+		self.docid = None
+		self.posting = None
+
+	def advance(self, docid):
+		# Moves to the first posting with docid >= docid
+		while self.docid is not None and self.docid < docid:
+			self.next()
+
+	def collect(self, docid, dict_of_posting_lists):
+		# Adds the current posting to dict_of_posting_lists if it belongs to docid
+		if self.docid != docid: return
+		try:
+			posting_list = dict_of_posting_lists[self.term]
+			if posting_list.posting_list[-1].docid == docid: return # Term repeated in the query
+			posting_list.append(self.posting)
+		except KeyError:
+			posting_list = dict_of_posting_lists[self.term] = PostingList(self.posting)
+		# Keep the collection-wide df so idf does not depend on how results are batched
+		posting_list.df = self.__df
+
+
+class Document_Iterator:
+	# Iterates over every docid from 1 to N. Used as the operand of a top-level NOT.
+	def __init__(self, N):
+		self.cost = N
+		self.__N = N
+		self.docid = 1 if N > 0 else None
+
+	def next(self):
+		if self.docid is None: return
+		self.docid = self.docid + 1 if self.docid < self.__N else None
+
+	def advance(self, docid):
+		if self.docid is not None and self.docid < docid:
+			self.docid = docid if docid <= self.__N else None
+
+	def collect(self, docid, dict_of_posting_lists):
+		pass
+
+
+class And_Iterator:
+	# Yields docids present in every child. Children are ordered by cost (df), so the
+	# rarest child leads and the others are only advanced to its candidates.
+	def __init__(self, children):
+		self.children = sorted(children, key=lambda child: child.cost)
+		self.cost = self.children[0].cost
+		self.docid = None
+		self.__align()
+
+	def __align(self):
+		lead = self.children[0]
+		while lead.docid is not None:
+			target = lead.docid
+			for child in self.children[1:]:
+				child.advance(target)
+				if child.docid is None:
+					self.docid = None
+					return
+				if child.docid > target:
+					lead.advance(child.docid)
+					break
+			else:
+				self.docid = target
+				return
+		self.docid = None
+
+	def next(self):
+		if self.docid is None: return
+		self.children[0].next()
+		self.__align()
+
+	def advance(self, docid):
+		if self.docid is None or self.docid >= docid: return
+		self.children[0].advance(docid)
+		self.__align()
+
+	def collect(self, docid, dict_of_posting_lists):
+		for child in self.children:
+			child.collect(docid, dict_of_posting_lists)
+
+
+class Or_Iterator:
+	# Yields docids present in any child, each docid once
+	def __init__(self, children):
+		self.children = children
+		self.cost = sum(child.cost for child in children)
+		self.docid = None
+		self.__update_docid()
+
+	def __update_docid(self):
+		docids = [child.docid for child in self.children if child.docid is not None]
+		self.docid = min(docids) if len(docids) != 0 else None
+
+	def next(self):
+		if self.docid is None: return
+		for child in self.children:
+			if child.docid == self.docid: child.next()
+		self.__update_docid()
+
+	def advance(self, docid):
+		if self.docid is None or self.docid >= docid: return
+		for child in self.children:
+			child.advance(docid)
+		self.__update_docid()
+
+	def collect(self, docid, dict_of_posting_lists):
+		for child in self.children:
+			if child.docid == docid: child.collect(docid, dict_of_posting_lists)
+
+
+class And_Not_Iterator:
+	# Yields docids of include that are not in exclude
+	def __init__(self, include, exclude):
+		self.include = include
+		self.exclude = exclude
+		self.cost = include.cost
+		self.docid = None
+		self.__skip_excluded()
+
+	def __skip_excluded(self):
+		while self.include.docid is not None:
+			self.exclude.advance(self.include.docid)
+			if self.exclude.docid != self.include.docid: break
+			self.include.next()
+		self.docid = self.include.docid
+
+	def next(self):
+		if self.docid is None: return
+		self.include.next()
+		self.__skip_excluded()
+
+	def advance(self, docid):
+		if self.docid is None or self.docid >= docid: return
+		self.include.advance(docid)
+		self.__skip_excluded()
+
+	def collect(self, docid, dict_of_posting_lists):
+		self.include.collect(docid, dict_of_posting_lists)
+
+
+def build_query_iterator(query_tree, get_term_iterator, N):
+	# Turns a normalized query tree into a tree of iterators.
+	# get_term_iterator(term) returns a Posting_Iterator for term.
+	# N is the number of documents, used when NOT has no positive operand to subtract from.
+
+	node_type = query_tree[0]
+
+	if node_type == "TERM":
+		return get_term_iterator(query_tree[1])
+
+	if node_type == "NOT":
+		return And_Not_Iterator(Document_Iterator(N), build_query_iterator(query_tree[1], get_term_iterator, N))
+
+	if node_type == "OR":
+		return Or_Iterator([build_query_iterator(child, get_term_iterator, N) for child in query_tree[1]])
+
+	# AND and IMPLICIT_AND: negated children are subtracted from the intersection of the others
+	include = [build_query_iterator(child, get_term_iterator, N) for child in query_tree[1] if child[0] != "NOT"]
+	exclude = [build_query_iterator(child[1], get_term_iterator, N) for child in query_tree[1] if child[0] == "NOT"]
+
+	if len(include) == 0: include = [Document_Iterator(N)]
+	query_iterator = include[0] if len(include) == 1 else And_Iterator(include)
+
+	if len(exclude) != 0:
+		query_iterator = And_Not_Iterator(query_iterator, exclude[0] if len(exclude) == 1 else Or_Iterator(exclude))
+
+	return query_iterator
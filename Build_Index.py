@@ -1,67 +1,98 @@
 # Author: Shuvam Raj Satyal
 
 from collections import defaultdict
+from itertools import chain, groupby
 from shutil import copyfile, rmtree
+import heapq
 import re
 from Inverted_Index import *
+from Duplicate_Detector import Duplicate_Detector
+from Suggester import Suggester
 
-# The optimal document batch size depends on hardware, OS, programming language, data structures used, etc
-DOCUMENT_BATCH_SIZE = 18465
-# Block size for binary merge
-MERGE_BLOCK_SIZE = 10 * 1000000 # 10 MB
+# Partial indexes are flushed to disk once the estimated size of the in-memory accumulators reaches this budget.
+# The estimate only covers the index data structures, so leave headroom below the actual memory limit.
+# The Duplicate_Detector is kept across flushes and is outside the budget: it grows by about 1 KB
+# per canonical document (its MinHash signature, LSH bucket entries and url) for the whole build.
+MEMORY_BUDGET = 500 * 1000000 # 500 MB
 
 # Patterns to re-construct posting lists from text files during merge
+INVERTED_INDEX_TERM_PATTERN = r"Term:(?P<term>\w+),"
 INVERTED_INDEX_LINE_PATTERN = r"Term:(?P<term>\w+),PostingList:\[(?P<PostingList>.+)\]\n"
 INVERTED_INDEX_POSTINGLIST_PATTERN = r"df:(?P<df>\d+),Postings:\[(?P<postings>.+)\]"
-INVERTED_INDEX_POSTING_PATTERN = r"docid:(\d+),tf:(\d+),fields:\[title:(\w+),heading:(\w+),bold:(\w+),strong:(\w+),italics:(\w+),emphasized:(\w+)\],termPositions:\[([0-9,]+)\]"
+INVERTED_INDEX_POSTING_PATTERN = r"docid:(\d+),tf:(\d+),fields:\[title:(\w+),heading:(\w+),bold:(\w+),strong:(\w+),italics:(\w+),emphasized:(\w+),anchor:(\w+)\],termPositions:\[([0-9,]*)\]"
 
+# Pattern to re-construct (target url, anchor tokens) records from anchor run files
+ANCHOR_RUN_LINE_PATTERN = r"URL:(?P<url>.+),Anchors:\[(?P<anchors>[a-zA-Z0-9,]*)\]\n"
+# Pattern to re-construct (word, df) records from vocabulary run files
+VOCABULARY_RUN_LINE_PATTERN = r"(?P<word>[a-z]+),(?P<df>\d+)\n"
 
-def generate_document_paths(document_paths):
-	# yields a batch of document paths with batch size = DOCUMENT_BATCH_SIZE
-	document_count = 0
-	batch = []
+# Maximum number of words, highest df first, kept by the Suggester
+MAX_VOCABULARY_SIZE = 100000
 
-	for document_path in document_paths:
-		batch.append(document_path)
-		document_count +=1
-		if document_count == DOCUMENT_BATCH_SIZE:
-			yield batch
-			document_count = 0
-			batch = []
 
-	if len(batch) != 0:
-		yield batch
+def write_inverted_index(fh, InvertedIndex, docid_offset=0):
+	# Sort inverted index and write to disk, shifting every docid by docid_offset
+	for term, posting_list in sorted(InvertedIndex.items()):
+		postings = []
+		for posting in posting_list.posting_list:
+			posting_term_positions = ','.join([str(tp) for tp in posting.termPositions])
+			posting_string = f"Posting(docid:{posting.docid+docid_offset},tf:{posting.tf},"\
+			f"fields:[title:{posting.fields['title']},heading:{posting.fields['heading']},"\
+			f"bold:{posting.fields['bold']},strong:{posting.fields['strong']},"\
+			f"italics:{posting.fields['italics']},emphasized:{posting.fields['emphasized']},"\
+			f"anchor:{posting.fields['anchor']}],"\
+			f"termPositions:[{posting_term_positions}])"
+			postings.append(posting_string)
 
+		write_line = f"Term:{term},PostingList:[df:{posting_list.df},Postings:[{','.join(postings)}]]\n"
+		fh.write(write_line)
 
 
-def BuildPartialInvertedIndexes(document_paths, storageDirPath, partialIndexesDirPath):
-	path_gen = generate_document_paths(document_paths) # Generator oject that yields subset of document paths based on DOCUMENT_BATCH_SIZE
+
+def BuildPartialInvertedIndexes(document_paths, storageDirPath, partialIndexesDirPath, anchorsDirPath, vocabularyDirPath, memory_budget=None):
+	# Indexes documents until the accumulators reach memory_budget (MEMORY_BUDGET by default),
+	# then flushes them as a partial index and continues with the remaining documents.
+	# Returns a list of stats for each flush.
+
+	if memory_budget is None: memory_budget = MEMORY_BUDGET
+	path_iter = iter(document_paths) # Shared by every batch so each one resumes where the previous flush stopped
 	max_document_index = 0
 	invertedIndex_count = 1 # Used for naming partial Inverted Indexes on disk
+	duplicate_detector = Duplicate_Detector() # Shared across batches so duplicates are found corpus-wide
+	flush_stats = []
 
 	while True:
 		try:
-			# Gets a subset of document paths from the generator
-			batch = next(path_gen)
+			# Check that documents remain before starting a new batch
+			batch = chain([next(path_iter)], path_iter)
 
 			# Builds the partial inverted Index and returns Document Index along with partial Inverted Index
-			DocumentIndex, InvertedIndex = BuildInvertedIndex(batch)
+			DocumentIndex, InvertedIndex, AnchorIndex, VocabularyIndex, IndexStats = BuildInvertedIndex(batch, duplicate_detector, memory_budget)
+
+			# The remaining documents may all have been skipped (fragments, empty pages, near-duplicates)
+			if len(DocumentIndex) == 0: continue
 
 			# Sort inverted index and write to disk
-			with open(os.path.join(partialIndexesDirPath, f"InvIndex_{invertedIndex_count}.txt"), 'w') as fh:
-				for term, posting_list in sorted(InvertedIndex.items()):
-					postings = []
-					for posting in posting_list.posting_list:
-						posting_term_positions = ','.join([str(tp) for tp in posting.termPositions])
-						posting_string = f"Posting(docid:{posting.docid+max_document_index},tf:{posting.tf},"\
-						f"fields:[title:{posting.fields['title']},heading:{posting.fields['heading']},"\
-						f"bold:{posting.fields['bold']},strong:{posting.fields['strong']},"\
-						f"italics:{posting.fields['italics']},emphasized:{posting.fields['emphasized']}],"\
-						f"termPositions:[{posting_term_positions}])"
-						postings.append(posting_string)
-
-					write_line = f"Term:{term},PostingList:[df:{posting_list.df},Postings:[{','.join(postings)}]]\n"
-					fh.write(write_line)
+			partial_index_path = os.path.join(partialIndexesDirPath, f"InvIndex_{invertedIndex_count}.txt")
+			with open(partial_index_path, 'w') as fh:
+				write_inverted_index(fh, InvertedIndex, max_document_index)
+
+			IndexStats["partial_index"] = partial_index_path
+			IndexStats["bytes_on_disk"] = os.path.getsize(partial_index_path)
+			flush_stats.append(IndexStats)
+			print(f"Flushed {partial_index_path}: {IndexStats['documents']} documents, {IndexStats['terms']} terms, "\
+			f"{IndexStats['postings']} postings, ~{IndexStats['estimated_bytes'] / 1000000:.1f} MB in memory, "\
+			f"{IndexStats['bytes_on_disk'] / 1000000:.1f} MB on disk")
+
+			# Sort anchor texts by target url and write to disk as a run for BuildAnchorIndex
+			with open(os.path.join(anchorsDirPath, f"Anchors_{invertedIndex_count}.txt"), 'w') as fh:
+				for target_url, anchor_tokens in sorted(AnchorIndex.items()):
+					fh.write(f"URL:{target_url},Anchors:[{','.join(anchor_tokens)}]\n")
+
+			# Sort word document frequencies and write to disk as a run for BuildSuggester
+			with open(os.path.join(vocabularyDirPath, f"Vocabulary_{invertedIndex_count}.txt"), 'w') as fh:
+				for word, df in sorted(VocabularyIndex.items()):
+					fh.write(f"{word},{df}\n")
 			
 			invertedIndex_count += 1
 
@@ -87,6 +118,12 @@ def BuildPartialInvertedIndexes(document_paths, storageDirPath, partialIndexesDi
 		except StopIteration:
 			break
 
+	# Store {near-duplicate url: canonical url} so links to duplicates can be resolved to the canonical document
+	with open(os.path.join(storageDirPath, "Duplicates.json"), 'w') as fh:
+		json.dump(duplicate_detector.duplicates, fh, indent=3)
+
+	return flush_stats
+
 def get_posting_list_from_txt_file(line):
 	boolDict = {"True": True, "False": False}
 	posting_list = PostingList()
@@ -105,8 +142,10 @@ def get_posting_list_from_txt_file(line):
 		strong =  boolDict[posting_match[5]]
 		italics =  boolDict[posting_match[6]]
 		emphasized =  boolDict[posting_match[7]]
-		termPositions =  [int(tp) for tp in posting_match[8].split(',')]
-		fields = {"title": title, "heading": heading, "bold": bold, "strong":strong, "italics": italics, "emphasized":emphasized}
+		anchor =  boolDict[posting_match[8]]
+		# Postings built only from anchor text have no term positions
+		termPositions =  [int(tp) for tp in posting_match[9].split(',') if tp != '']
+		fields = {"title": title, "heading": heading, "bold": bold, "strong":strong, "italics": italics, "emphasized":emphasized, "anchor":anchor}
 
 		# Create a new posting to add into the return posting list
 		new_posting = Posting(docid, tf, fields)
@@ -116,8 +155,125 @@ def get_posting_list_from_txt_file(line):
 	return (term, posting_list)
 
 
+
+def merge_duplicate_postings(posting_list):
+	# Combines postings that share a docid, e.g. a body posting and an anchor text posting
+	# for the same document. Fields are OR-ed, tf is summed and term positions are unioned.
+	merged_postings = []
+	for posting in posting_list.posting_list:
+		if len(merged_postings) != 0 and merged_postings[-1].docid == posting.docid:
+			prev_posting = merged_postings[-1]
+			prev_posting.tf += posting.tf
+			prev_posting.fields = {field: value or posting.fields[field] for field, value in prev_posting.fields.items()}
+			prev_posting.termPositions = sorted(set(prev_posting.termPositions).union(posting.termPositions))
+		else:
+			merged_postings.append(posting)
+
+	posting_list.posting_list = merged_postings
+	posting_list.df = len(merged_postings)
+
+
+
+def generate_anchor_records(fh):
+	# Yields (target url, anchor tokens) for each line of a sorted anchor run file
+	for line in fh:
+		line_match = re.match(ANCHOR_RUN_LINE_PATTERN, line)
+		if line_match is None: continue
+		anchors = line_match.group("anchors")
+		yield line_match.group("url"), anchors.split(',') if anchors != '' else []
+
+
+
+def write_anchor_index(path, InvertedIndex):
+	# Target urls are grouped in url order and several urls can share a docid (near-duplicates),
+	# so postings are sorted by docid and combined before writing. Every partial index then has
+	# at most one posting per docid on each line, in docid order, which BinaryMerge relies on.
+	for posting_list in InvertedIndex.values():
+		posting_list.posting_list.sort(key=lambda x: x.docid)
+		merge_duplicate_postings(posting_list)
+
+	with open(path, 'w') as fh:
+		write_inverted_index(fh, InvertedIndex)
+
+
+
+def BuildAnchorIndex(storageDirPath, partialIndexesDirPath, anchorsDirPath, delete_anchor_runs=False, memory_budget=None):
+	# Aggregates anchor texts from every batch by target url and writes them as extra partial
+	# inverted indexes whose postings only have the anchor field set. BinaryMerge then folds
+	# them into the final index alongside the body postings.
+	# Anchor runs are k-way merged as streams, so only the anchors of one target url
+	# and at most memory_budget (MEMORY_BUDGET by default) bytes of postings are held in memory.
+
+	if memory_budget is None: memory_budget = MEMORY_BUDGET
+	stemmer = snowball.SnowballStemmer('english')
+	anchor_fields = {"title": False, "heading": False, "bold": False, "strong":False, "italics": False, "emphasized":False, "anchor":True}
+
+	# Anchor text is only indexed for urls that were indexed as documents
+	with open(os.path.join(storageDirPath, "DocIndex.json"), 'r') as fh:
+		url_to_docid = {url: int(docid) for docid, (url, doc_path) in json.load(fh).items()}
+
+	# Anchor text pointing to a near-duplicate describes its canonical document
+	try:
+		with open(os.path.join(storageDirPath, "Duplicates.json"), 'r') as fh:
+			for duplicate_url, canonical_url in json.load(fh).items():
+				url_to_docid[duplicate_url] = url_to_docid[canonical_url]
+	except FileNotFoundError:
+		pass
+
+	anchor_run_paths = sorted([os.path.join(anchorsDirPath, f) for f in os.listdir(anchorsDirPath) if os.path.isfile(os.path.join(anchorsDirPath, f)) and f != ".DS_Store"])
+	anchor_run_fhs = [open(path, 'r') for path in anchor_run_paths]
+	anchor_records = heapq.merge(*[generate_anchor_records(fh) for fh in anchor_run_fhs], key=lambda x: x[0])
+
+	InvertedIndex = {}
+	estimated_bytes = 0 # Approximate size of InvertedIndex
+	anchorIndex_count = 1
+
+	for target_url, records in groupby(anchor_records, key=lambda x: x[0]):
+		try:
+			docid = url_to_docid[target_url]
+		except KeyError:
+			# Link points outside the corpus or to a page without text
+			continue
+
+		anchor_tokens = []
+		for _, tokens in records:
+			anchor_tokens.extend(stemmer.stem(token) for token in tokens)
+
+		for term, tf in get_token_frequency(anchor_tokens).items():
+			try:
+				InvertedIndex[term].append(Posting(docid=docid, tf=tf, fields=dict(anchor_fields)))
+				estimated_bytes += POSTING_BYTES
+			except KeyError:
+				InvertedIndex[term] = PostingList(Posting(docid=docid, tf=tf, fields=dict(anchor_fields)))
+				estimated_bytes += sys.getsizeof(term) + POSTING_LIST_BYTES + POSTING_BYTES
+
+		if estimated_bytes >= memory_budget:
+			write_anchor_index(os.path.join(partialIndexesDirPath, f"InvIndex_anchors_{anchorIndex_count}.txt"), InvertedIndex)
+			anchorIndex_count += 1
+			estimated_bytes = 0
+			InvertedIndex = {}
+
+	if len(InvertedIndex) != 0:
+		write_anchor_index(os.path.join(partialIndexesDirPath, f"InvIndex_anchors_{anchorIndex_count}.txt"), InvertedIndex)
+
+	for fh in anchor_run_fhs:
+		fh.close()
+
+	if delete_anchor_runs:
+		rmtree(anchorsDirPath)
+
+
+def get_term_from_txt_file(line):
+	# Reads only the term of an inverted index line, without parsing its postings
+	return re.match(INVERTED_INDEX_TERM_PATTERN, line).group("term")
+
+
+
 def BinaryMerge(partialIndexesDirPath, mergedIndexesDirPath):
-	# Merges Posting lists from two files at a time
+	# Merges Posting lists from two files at a time.
+	# Both files are sorted by term, so they are merged line by line like the merge step of merge sort.
+	# A term found in only one file is copied as it is. A term found in both gets a single line, so
+	# postings for the same document (e.g. from body and anchor text) always meet in merge_duplicate_postings.
 
 	# mergeQueue initially contains paths of partial indexes
 	mergeQueue = sorted([os.path.join(partialIndexesDirPath, f) for f in os.listdir(partialIndexesDirPath) if os.path.isfile(os.path.join(partialIndexesDirPath, f)) and f != ".DS_Store"])
@@ -132,71 +288,32 @@ def BinaryMerge(partialIndexesDirPath, mergedIndexesDirPath):
 		mergeQueue.append(mergedIndex_path)
 		output_fh = open(mergedIndex_path, 'w')
 
-		block_1 = {}
-		block_2 = {}
-		output_dict = defaultdict(PostingList)
-		EOF_1 = False
-		EOF_2 = False
-
 		print(f"Merging {fh1.name} and {fh2.name} into {output_fh.name}")
 
-		while True:
-			try:
-				if EOF_1: raise EOFError
-				while sys.getsizeof(block_1) < MERGE_BLOCK_SIZE:
-					# Load a block of data of size = MERGE_BLOCK_SIZE
-					line = fh1.readline()
-					data = get_posting_list_from_txt_file(line)
-					# {key = term, value = PostingList}
-					block_1[data[0]] = data[1]
-
-			except (EOFError, AttributeError):
-				EOF_1 = True
-
-			try:
-				if EOF_2: raise EOFError
-				while sys.getsizeof(block_2) < MERGE_BLOCK_SIZE:
-					# Load a block of data of size = MERGE_BLOCK_SIZE
-					line = fh2.readline()
-					data = get_posting_list_from_txt_file(line)
-					# {key = term, value = PostingList}
-					block_2[data[0]] = data[1]
-					
-			except (EOFError, AttributeError):
-				EOF_2 = True
-
-
-			# Perform merge opeation
-			for key in set().union(block_1, block_2):
-				for dic in [block_1, block_2]:
-					if key in dic:
-						output_dict[key].posting_list += dic[key].posting_list
-						output_dict[key].df += dic[key].df
-						output_dict[key].posting_list.sort(key=lambda x: x.docid)
-
+		line_1 = fh1.readline()
+		line_2 = fh2.readline()
+		while line_1 != '' and line_2 != '':
+			term_1 = get_term_from_txt_file(line_1)
+			term_2 = get_term_from_txt_file(line_2)
+			if term_1 < term_2:
+				output_fh.write(line_1)
+				line_1 = fh1.readline()
+			elif term_2 < term_1:
+				output_fh.write(line_2)
+				line_2 = fh2.readline()
+			else:
+				term, posting_list = get_posting_list_from_txt_file(line_1)
+				posting_list.posting_list += get_posting_list_from_txt_file(line_2)[1].posting_list
+				posting_list.posting_list.sort(key=lambda x: x.docid)
+				merge_duplicate_postings(posting_list)
+				write_inverted_index(output_fh, {term: posting_list})
+				line_1 = fh1.readline()
+				line_2 = fh2.readline()
+
+		# Copy the rest of whichever file is left
+		for line in chain([line_1, line_2], fh1, fh2):
+			output_fh.write(line)
 
-			# Sort inverted index and write to disk
-			for term, posting_list in sorted(output_dict.items()):
-				postings = []
-				for posting in posting_list.posting_list:
-					posting_term_positions = ','.join([str(tp) for tp in posting.termPositions])
-					posting_string = f"Posting(docid:{posting.docid},tf:{posting.tf},"\
-					f"fields:[title:{posting.fields['title']},heading:{posting.fields['heading']},"\
-					f"bold:{posting.fields['bold']},strong:{posting.fields['strong']},"\
-					f"italics:{posting.fields['italics']},emphasized:{posting.fields['emphasized']}],"\
-					f"termPositions:[{posting_term_positions}])"
-					postings.append(posting_string)
-
-				write_line = f"Term:{term},PostingList:[df:{posting_list.df},Postings:[{','.join(postings)}]]\n"
-				output_fh.write(write_line)
-
-			block_1 = {}
-			block_2 = {}
-			output_dict = defaultdict(PostingList)
-
-			# Exit while loop if EOF reached for both files
-			if EOF_1 and EOF_2: break
- 
 		# Close file handles
 		fh1.close()
 		fh2.close()
@@ -244,11 +361,52 @@ def BuildMetaIndex(meta_index_name, inv_index_name, storage_dir_path):
 		json.dump(meta_index, fh, indent=2)
 
 
+
+def generate_vocabulary_records(fh):
+	# Yields (word, df) for each line of a sorted vocabulary run file
+	for line in fh:
+		line_match = re.match(VOCABULARY_RUN_LINE_PATTERN, line)
+		if line_match is None: continue
+		yield line_match.group("word"), int(line_match.group("df"))
+
+
+
+def BuildSuggester(suggester_name, storage_dir_path, vocabulary_dir_path, delete_vocabulary_runs=False):
+	# Sums the document frequency of every word across the vocabulary runs and pickles a Suggester
+	# built from the MAX_VOCABULARY_SIZE words with the highest df.
+	# Runs are k-way merged as streams, so only the kept words are held in memory.
+
+	vocabulary_run_paths = sorted([os.path.join(vocabulary_dir_path, f) for f in os.listdir(vocabulary_dir_path) if os.path.isfile(os.path.join(vocabulary_dir_path, f)) and f != ".DS_Store"])
+	vocabulary_run_fhs = [open(path, 'r') for path in vocabulary_run_paths]
+	vocabulary_records = heapq.merge(*[generate_vocabulary_records(fh) for fh in vocabulary_run_fhs], key=lambda x: x[0])
+
+	# Min-heap of (df, word), so the lowest df word is replaced first once the heap is full
+	vocabulary = []
+	for word, records in groupby(vocabulary_records, key=lambda x: x[0]):
+		df = sum(record_df for _, record_df in records)
+		if len(vocabulary) < MAX_VOCABULARY_SIZE:
+			heapq.heappush(vocabulary, (df, word))
+		elif df > vocabulary[0][0]:
+			heapq.heapreplace(vocabulary, (df, word))
+
+	for fh in vocabulary_run_fhs:
+		fh.close()
+
+	with open(os.path.join(storage_dir_path, suggester_name), 'wb') as fh:
+		pickle.dump(Suggester((word, df) for df, word in vocabulary), fh)
+
+	if delete_vocabulary_runs:
+		rmtree(vocabulary_dir_path)
+
+
 if __name__ == "__main__":
 	partial_indexes_dir_name = 'Partial_Indexes'
 	merged_indexes_dir_name = 'Merged_Indexes'
+	anchors_dir_name = 'Anchors'
+	vocabulary_dir_name = 'Vocabulary'
 	inv_index_name = 'InvIndex.txt'
 	meta_index_name = "MetaIndex.json"
+	suggester_name = "Suggester.pkl"
 
 
 	if len(sys.argv) != 3:
@@ -261,12 +419,20 @@ if __name__ == "__main__":
 	partial_indexes_dir_path = os.path.join(storage_dir_path, partial_indexes_dir_name)
 	if not os.path.exists(partial_indexes_dir_path): os.makedirs(partial_indexes_dir_path)
 
+	anchors_dir_path = os.path.join(storage_dir_path, anchors_dir_name)
+	if not os.path.exists(anchors_dir_path): os.makedirs(anchors_dir_path)
+
+	vocabulary_dir_path = os.path.join(storage_dir_path, vocabulary_dir_name)
+	if not os.path.exists(vocabulary_dir_path): os.makedirs(vocabulary_dir_path)
+
 	document_paths = get_document_paths(corpus_path)
-	BuildPartialInvertedIndexes(document_paths, storage_dir_path, partial_indexes_dir_path)
+	BuildPartialInvertedIndexes(document_paths, storage_dir_path, partial_indexes_dir_path, anchors_dir_path, vocabulary_dir_path)
+	BuildAnchorIndex(storage_dir_path, partial_indexes_dir_path, anchors_dir_path, delete_anchor_runs=True)
 
 	merged_indexes_dir_path = os.path.join(storage_dir_path, merged_indexes_dir_name)
 	if not os.path.exists(merged_indexes_dir_path): os.makedirs(merged_indexes_dir_path)
 
 	BinaryMerge(partial_indexes_dir_path, merged_indexes_dir_path)
 	extractFinalIndex(inv_index_name, storage_dir_path, partial_indexes_dir_path, merged_indexes_dir_path, delete_sub_indexes=True)
-	BuildMetaIndex(meta_index_name, inv_index_name, storage_dir_path)
\ No newline at end of file
+	BuildMetaIndex(meta_index_name, inv_index_name, storage_dir_path)
+	BuildSuggester(suggester_name, storage_dir_path, vocabulary_dir_path, delete_vocabulary_runs=True)
\ No newline at end of file
@@ -0,0 +1,104 @@
+# Author: Shuvam Raj Satyal
+
+import hashlib
+from array import array
+from bisect import bisect_left
+
+# Number of consecutive words per shingle (the features hashed into a signature)
+SHINGLE_SIZE = 3
+# Number of bins of a one-permutation MinHash signature. Each shingle is hashed once; its low
+# bits pick a bin and the bin keeps the smallest of the remaining bits, so building a signature
+# costs one pass over the shingles however many bins there are.
+SIGNATURE_BINS = 64
+SIGNATURE_BIN_BITS = SIGNATURE_BINS.bit_length() - 1
+# Signature values are truncated to 32 bits, so each document keeps SIGNATURE_BINS * 4 bytes
+SIGNATURE_VALUE_MASK = 0xFFFFFFFF
+# Added per bin of distance when an empty bin borrows the value of the next non-empty one,
+# so borrowed values only match when two documents borrow from the same distance
+DENSIFICATION_OFFSET = 0x9E3779B1
+# LSH bands over the first LSH_BANDS * LSH_ROWS bins. Documents with Jaccard similarity 0.7
+# share a band 99.5% of the time, while documents sharing no shingles practically never do.
+LSH_BANDS = 8
+LSH_ROWS = 2
+# Minimum estimated Jaccard similarity of the shingle sets of near-duplicate documents.
+# A one-word edit of a 30-word page leaves about 0.8 of its shingles shared.
+JACCARD_THRESHOLD = 0.7
+
+
+def get_token_hash(token):
+	# Stable 64-bit hash of a token (the built-in hash() is randomized per process)
+	return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def get_shingles(tokens):
+	# Returns the set of distinct SHINGLE_SIZE-word shingles in tokens
+	tokens = [token.lower() for token in tokens]
+	return {' '.join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))}
+
+
+def get_minhash(shingles):
+	# Computes the one-permutation MinHash signature of a set of shingles.
+	# The fraction of equal bins in two signatures estimates the Jaccard similarity of the sets.
+
+	bins = [None] * SIGNATURE_BINS
+	for shingle in shingles:
+		shingle_hash = get_token_hash(shingle)
+		value = shingle_hash >> SIGNATURE_BIN_BITS
+		bin_number = shingle_hash & (SIGNATURE_BINS - 1)
+		if bins[bin_number] is None or value < bins[bin_number]: bins[bin_number] = value
+
+	# Short documents leave bins empty. Each empty bin borrows from the next non-empty bin (rotation densification).
+	filled_bins = [bin_number for bin_number, value in enumerate(bins) if value is not None]
+	signature = array('I')
+	for bin_number, value in enumerate(bins):
+		if value is None:
+			donor = filled_bins[bisect_left(filled_bins, bin_number) % len(filled_bins)]
+			value = bins[donor] + (donor - bin_number) % SIGNATURE_BINS * DENSIFICATION_OFFSET
+		signature.append(value & SIGNATURE_VALUE_MASK)
+
+	return signature
+
+
+def get_minhash_similarity(signature_1, signature_2):
+	return sum(1 for value_1, value_2 in zip(signature_1, signature_2) if value_1 == value_2) / SIGNATURE_BINS
+
+
+class Duplicate_Detector:
+	def __init__(self):
+		# Signatures of canonical documents, SIGNATURE_BINS values each, in one flat array
+		self.__signatures = array('I')
+		self.__canonical_urls = []
+		# {key = hash of (band number, band values): value = canonical document number, or a list of them if several share the band}
+		self.__buckets = {}
+		# {key = near-duplicate url: value = canonical url}
+		self.duplicates = {}
+
+	def get_canonical_url(self, url, tokens):
+		# Returns the url of a previously seen near-duplicate of this document, or None.
+		# Documents without a near-duplicate become canonical and are added to the buckets.
+		# Only documents sharing a band are compared, so lookups avoid a pairwise scan of the corpus.
+
+		signature = get_minhash(get_shingles(tokens))
+		band_keys = [hash((band, *signature[band * LSH_ROWS:(band + 1) * LSH_ROWS])) for band in range(LSH_BANDS)]
+
+		for band_key in band_keys:
+			candidates = self.__buckets.get(band_key, [])
+			for candidate in candidates if isinstance(candidates, list) else [candidates]:
+				candidate_signature = self.__signatures[candidate * SIGNATURE_BINS:(candidate + 1) * SIGNATURE_BINS]
+				if get_minhash_similarity(signature, candidate_signature) >= JACCARD_THRESHOLD:
+					canonical_url = self.__canonical_urls[candidate]
+					self.duplicates[url] = canonical_url
+					return canonical_url
+
+		document_number = len(self.__canonical_urls)
+		self.__signatures.extend(signature)
+		self.__canonical_urls.append(url)
+		for band_key in band_keys:
+			try:
+				candidates = self.__buckets[band_key]
+				if isinstance(candidates, list): candidates.append(document_number)
+				else: self.__buckets[band_key] = [candidates, document_number]
+			except KeyError:
+				self.__buckets[band_key] = document_number
+
+		return None
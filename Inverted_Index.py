@@ -5,7 +5,8 @@ import os
 import json
 import pickle
 from bs4 import BeautifulSoup
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urljoin, urldefrag
+from collections import defaultdict
 import nltk
 from nltk.tokenize import RegexpTokenizer
 from nltk.stem import snowball
@@ -110,23 +111,64 @@ def get_posting_fields(HTML_tag_fields, token):
 	# Checks if token is present inside HTML tags like title, i, b, em, strong
 	# based on the dictionary created by get_HTML_tag_fields().
 
-	posting_fields = {"title": False, "heading": False, "bold": False, "strong":False, "italics": False, "emphasized":False}
+	posting_fields = {"title": False, "heading": False, "bold": False, "strong":False, "italics": False, "emphasized":False, "anchor":False}
 	
 	for field, words in HTML_tag_fields.items():
 		if token in words:
 			posting_fields[field] = True
 
 	return posting_fields
-	
-	
 
-def BuildInvertedIndex(document_paths):
+
+
+def get_posting_size(posting):
+	# Approximate bytes held by a Posting and its fields, excluding term positions
+	return sys.getsizeof(posting) + sys.getsizeof(posting.__dict__) + sys.getsizeof(posting.fields) + sys.getsizeof(posting.termPositions)
+
+
+
+# Approximate in-memory sizes used to estimate the footprint of the indexer's accumulators.
+# Each includes the 8 byte reference held by the containing list or dict.
+POSTING_BYTES = get_posting_size(Posting(docid=0, tf=1, fields=get_posting_fields({}, ''))) + 8
+POSTING_LIST_BYTES = sys.getsizeof(PostingList()) + sys.getsizeof(PostingList().__dict__) + sys.getsizeof([]) + 3 * 8 # + dict slot (hash, key, value)
+TERM_POSITION_BYTES = sys.getsizeof(1000) + 8
+
+
+
+def get_anchor_texts(soup, url):
+	# Tokenizes the text of every <a href> in the page.
+	# Returns a list of (target url, anchor tokens) where target url is resolved
+	# against the page url and stripped of fragments so it matches DocumentIndex urls.
+
+	anchor_texts = []
+	for elem in soup.find_all("a", href=True):
+		target_url = urldefrag(urljoin(url, elem["href"]))[0]
+		# Ignore self links and links without any indexable text
+		if target_url == url: continue
+		anchor_tokens = tokenize(elem.get_text())
+		if len(anchor_tokens) == 0: continue
+		anchor_texts.append((target_url, anchor_tokens))
+
+	return anchor_texts
+
+
+
+
+def BuildInvertedIndex(document_paths, duplicate_detector=None, memory_budget=None):
 	# In-memory indexer for creating inverted index
+	# Near-duplicates of already indexed documents are skipped if a Duplicate_Detector is given.
+	# If memory_budget (bytes) is given, indexing stops after the document that pushes the estimated
+	# size of the accumulators past it. Pass an iterator as document_paths to resume from there.
+	# Returns DocumentIndex, InvertedIndex, AnchorIndex, VocabularyIndex and IndexStats describing the accumulators.
 	
 	stemmer = snowball.SnowballStemmer('english')
 	DocumentIndex = {} # {key = doc_id: value = (url, doc_path)}
 	InvertedIndex = {} # Inverted list storage (dictionary of tokens/words/n-grams + posting lists)
+	AnchorIndex = defaultdict(list) # {key = target url: value = list of anchor text tokens pointing to it}
+	VocabularyIndex = defaultdict(int) # {key = lowercase word before stemming: value = document frequency}
 	n = 0 # Document numbering
+	posting_count = 0
+	estimated_bytes = 0 # Approximate size of DocumentIndex, InvertedIndex, AnchorIndex and VocabularyIndex
 
 	for document_path in document_paths:
 		# Read json file which contains ['url', 'content', 'encoding'] for a document
@@ -143,21 +185,43 @@ def BuildInvertedIndex(document_paths):
 
 		# check if the page contains any text
 		if text == '': continue
+
+		tokens = tokenize(text) # tokenize text in html document
+
+		# Only the first document of each near-duplicate cluster gets a docid
+		if duplicate_detector is not None:
+			canonical_url = duplicate_detector.get_canonical_url(url, tokens)
+			if canonical_url is not None:
+				print(f"Skipping {url} (near-duplicate of {canonical_url})")
+				continue
+
 		n += 1
 		print(f"Indexing document #{n}")
 
 		DocumentIndex[n] = (url, document_path)
-		tokens = tokenize(text) # tokenize text in html document
+		estimated_bytes += sys.getsizeof(url) + sys.getsizeof(document_path) + sys.getsizeof(DocumentIndex[n]) + 3 * 8
 		tokenFrequency = get_token_frequency(tokens)
 		tokens = set(tokens) # remove duplicate tokens
 
+		# Unstemmed words are kept for spelling correction and autocomplete. Numbers are left out.
+		for word in {token.lower() for token in tokens if token.isalpha()}:
+			if word not in VocabularyIndex: estimated_bytes += sys.getsizeof(word) + sys.getsizeof(1000) + 3 * 8
+			VocabularyIndex[word] += 1
+
 		HTML_tag_fields = get_HTML_tag_fields(soup)
 
+		# Anchor text describes the target page, not this one.
+		# It is collected here and indexed for the target url once all batches are done.
+		for target_url, anchor_tokens in get_anchor_texts(soup, url):
+			AnchorIndex[target_url].extend(anchor_tokens)
+			estimated_bytes += sys.getsizeof(target_url) + sum(sys.getsizeof(token) + 8 for token in anchor_tokens)
+
 		for term_position, token in enumerate(tokens):
+			term = stemmer.stem(token)
 			# Check if a PostingList is present in the inverted index,
 			# Add the new {token : PostingList} to inverted index otherwise.
 			try:
-				posting_list = InvertedIndex[stemmer.stem(token)]
+				posting_list = InvertedIndex[term]
 				# Check if a Posting is present in the posting_list,
 				# Add the new Posting to posting_list otherwise.
 				try:
@@ -165,15 +229,24 @@ def BuildInvertedIndex(document_paths):
 					# Append term position to posting.term_postitions
 					posting = posting_list[n]
 					posting.append_term_position(term_position)
+					estimated_bytes += TERM_POSITION_BYTES
 
 				except IndexError:
 					# if Posting 'n' is not present in the posting_list
 					posting_list.append(Posting(docid=n, tf=tokenFrequency[token], fields=get_posting_fields(HTML_tag_fields, token), termPosition=term_position))
+					posting_count += 1
+					estimated_bytes += POSTING_BYTES + TERM_POSITION_BYTES
 
 			except KeyError:
-				InvertedIndex[stemmer.stem(token)] = PostingList(Posting(docid=n, tf=tokenFrequency[token], fields=get_posting_fields(HTML_tag_fields, token), termPosition=term_position))
+				InvertedIndex[term] = PostingList(Posting(docid=n, tf=tokenFrequency[token], fields=get_posting_fields(HTML_tag_fields, token), termPosition=term_position))
+				posting_count += 1
+				estimated_bytes += sys.getsizeof(term) + POSTING_LIST_BYTES + POSTING_BYTES + TERM_POSITION_BYTES
+
+		if memory_budget is not None and estimated_bytes >= memory_budget: break
+
+	IndexStats = {"documents": n, "terms": len(InvertedIndex), "postings": posting_count, "estimated_bytes": estimated_bytes}
 
-	return DocumentIndex, InvertedIndex
+	return DocumentIndex, InvertedIndex, AnchorIndex, VocabularyIndex, IndexStats
 
 
 
@@ -187,7 +260,7 @@ if __name__ == "__main__":
 
 
 	document_paths = get_document_paths(corpus_path)
-	DocumentIndex, InvertedIndex = BuildInvertedIndex(document_paths)
+	DocumentIndex, InvertedIndex, AnchorIndex, VocabularyIndex, IndexStats = BuildInvertedIndex(document_paths)
 
 	# Store DocumentIndex on disk for future retrieval
 	with open(os.path.join(storage_path, "DocIndex.json"), 'w') as fh:
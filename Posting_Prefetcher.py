@@ -0,0 +1,41 @@
+# Author: Shuvam Raj Satyal
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of inverted index lines read concurrently
+PREFETCH_THREADS = 8
+
+
+class Posting_Prefetcher:
+	# Reads inverted index lines on a thread pool so the reads for every term of a query are
+	# in flight at once. Each worker thread has its own file handle, so reads don't contend
+	# on a shared file position.
+	def __init__(self, inv_index_path, threads=PREFETCH_THREADS):
+		self.__inv_index_path = inv_index_path
+		self.__thread_data = threading.local()
+		self.__file_handles = [] # Every worker's file handle, closed by close()
+		self.__lock = threading.Lock()
+		self.__executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="posting-prefetch")
+
+	def __read_line(self, record_position):
+		try:
+			fh = self.__thread_data.fh
+		except AttributeError:
+			fh = self.__thread_data.fh = open(self.__inv_index_path, 'r')
+			with self.__lock:
+				self.__file_handles.append(fh)
+
+		fh.seek(record_position)
+		return fh.readline()
+
+	def prefetch(self, record_position):
+		# Starts reading the line at record_position and returns a Future of the line
+		return self.__executor.submit(self.__read_line, record_position)
+
+	def close(self):
+		self.__executor.shutdown(wait=True)
+		with self.__lock:
+			for fh in self.__file_handles:
+				fh.close()
+			self.__file_handles = []
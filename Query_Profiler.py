@@ -0,0 +1,119 @@
+# Author: Shuvam Raj Satyal
+
+import os
+import json
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Profiling is opt-in. Set SEARCH_PROFILE=1 to collect in-process stats,
+# or SEARCH_PROFILE_LOG=<path> to also append one JSON line per query to <path>.
+PROFILE_ENABLED = os.environ.get("SEARCH_PROFILE", "0") == "1"
+PROFILE_LOG_PATH = os.environ.get("SEARCH_PROFILE_LOG")
+
+# Number of most recent query traces kept in memory for get_stats()
+MAX_RECORDED_QUERIES = 1000
+
+
+def get_percentile(sorted_values, percentile):
+	# Nearest-rank percentile of an already sorted list
+	if len(sorted_values) == 0: return 0
+	rank = max(0, min(len(sorted_values) - 1, int(round(percentile / 100 * len(sorted_values))) - 1))
+	return sorted_values[rank]
+
+
+class Query_Profiler:
+	def __init__(self, enabled=PROFILE_ENABLED or PROFILE_LOG_PATH is not None, log_path=PROFILE_LOG_PATH):
+		self.enabled = enabled
+		self.log_path = log_path
+		self.__trace = None
+		self.__recorded_traces = deque(maxlen=MAX_RECORDED_QUERIES)
+
+	def start_query(self, query, page=1):
+		if not self.enabled: return
+		self.__trace = {
+			"query": query,
+			"page": page,
+			"timestamp": time.time(),
+			"start_ns": time.perf_counter_ns(),
+			"stages": defaultdict(lambda: {"ns": 0, "calls": 0}),
+			"counters": defaultdict(int),
+		}
+
+	@contextmanager
+	def span(self, stage):
+		# Times the enclosed block under stage. Spans may nest, in which case
+		# the outer stage's time includes the inner stage's time.
+		if not self.enabled or self.__trace is None:
+			yield
+			return
+		start_ns = time.perf_counter_ns()
+		try:
+			yield
+		finally:
+			self.add_span(stage, time.perf_counter_ns() - start_ns)
+
+	def add_span(self, stage, elapsed_ns):
+		# For stages that can't be wrapped in span(), e.g. work inside a generator between yields
+		if not self.enabled or self.__trace is None: return
+		self.__trace["stages"][stage]["ns"] += elapsed_ns
+		self.__trace["stages"][stage]["calls"] += 1
+
+	def count(self, counter, value=1):
+		if not self.enabled or self.__trace is None: return
+		self.__trace["counters"][counter] += value
+
+	def end_query(self):
+		# Finishes the current trace, records it for get_stats() and appends it to the JSON log.
+		# Returns the finished trace, or None if profiling is disabled.
+		if not self.enabled or self.__trace is None: return None
+
+		trace = self.__trace
+		self.__trace = None
+		record = {
+			"query": trace["query"],
+			"page": trace["page"],
+			"timestamp": trace["timestamp"],
+			"total_ns": time.perf_counter_ns() - trace["start_ns"],
+			"stages": dict(trace["stages"]),
+			"counters": dict(trace["counters"]),
+		}
+		self.__recorded_traces.append(record)
+
+		if self.log_path is not None:
+			with open(self.log_path, 'a') as fh:
+				fh.write(json.dumps(record) + '\n')
+
+		return record
+
+	def get_stats(self):
+		# Aggregates the recorded traces into
+		# {"queries": n, "total": {...}, "stages": {stage: {...}}, "counters": {counter: sum}}
+		# where each latency summary has calls, total_ns, p50_ns and p99_ns.
+
+		stage_latencies = defaultdict(list)
+		stage_calls = defaultdict(int)
+		counters = defaultdict(int)
+
+		for record in self.__recorded_traces:
+			for stage, data in record["stages"].items():
+				stage_latencies[stage].append(data["ns"])
+				stage_calls[stage] += data["calls"]
+			for counter, value in record["counters"].items():
+				counters[counter] += value
+
+		def summarize(latencies, calls):
+			latencies = sorted(latencies)
+			return {"calls": calls, "total_ns": sum(latencies), "p50_ns": get_percentile(latencies, 50), "p99_ns": get_percentile(latencies, 99)}
+
+		total_latencies = [record["total_ns"] for record in self.__recorded_traces]
+
+		return {
+			"queries": len(self.__recorded_traces),
+			"total": summarize(total_latencies, len(total_latencies)),
+			"stages": {stage: summarize(latencies, stage_calls[stage]) for stage, latencies in stage_latencies.items()},
+			"counters": dict(counters),
+		}
+
+	def reset_stats(self):
+		self.__recorded_traces.clear()
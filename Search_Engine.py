@@ -1,5 +1,6 @@
 # Author: Shuvam Raj Satyal
 
+import heapq
 import math
 import re
 import time
@@ -7,21 +8,40 @@ from nltk.corpus import stopwords
 from collections import defaultdict
 from Inverted_Index import *
 from Search_Cache import Search_Cache
+from Query_Profiler import Query_Profiler
+from Boolean_Query import *
+from Posting_Prefetcher import Posting_Prefetcher
+
+try:
+	import readline
+except ImportError:
+	readline = None # Tab completion of query words is unavailable, e.g. on Windows
 
 # Patterns to re-construct posting lists from inverted index
 INVERTED_INDEX_LINE_PATTERN = r"Term:(?P<term>\w+),PostingList:\[(?P<PostingList>.+)\]\n"
 INVERTED_INDEX_POSTINGLIST_PATTERN = r"df:(?P<df>\d+),Postings:\[(?P<postings>.+)\]"
-INVERTED_INDEX_POSTING_PATTERN = r"docid:(\d+),tf:(\d+),fields:\[title:(\w+),heading:(\w+),bold:(\w+),strong:(\w+),italics:(\w+),emphasized:(\w+)\],termPositions:\[([0-9,]+)\]"
+INVERTED_INDEX_POSTING_PATTERN = r"docid:(\d+),tf:(\d+),fields:\[title:(\w+),heading:(\w+),bold:(\w+),strong:(\w+),italics:(\w+),emphasized:(\w+),anchor:(\w+)\],termPositions:\[([0-9,]*)\]"
+# Pattern to read the df of a term from the head of its line in inverted index
+INVERTED_INDEX_DF_PATTERN = r"Term:\w+,PostingList:\[df:(?P<df>\d+),"
 
-# Maximum number of postings yielded per query term
+# Maximum number of matching documents per batch of results
 RESULT_BATCH_SIZE = 100
 
-# Maximum number of query terms to process
-QUERY_THRESHOLD = 10
+# Score added when a query term appears in title, heading, bold, strong, italics, or emphasized text
+HTML_FIELD_WEIGHT = 1
+# Score added when a query term appears in anchor text of links pointing to the document
+ANCHOR_FIELD_WEIGHT = 1.5
 
 DISPLAY_URLS_ONLY = True
 
+# Read the posting lists of all query terms concurrently instead of one after another.
+# Off by default: on the synthetic benchmark the thread handoff made warm cache queries slower
+# and cold cache queries no faster, since decoding rather than reading dominates query time.
+PREFETCH_POSTINGS = False
+
 CACHE = Search_Cache()
+PROFILER = Query_Profiler()
+PREFETCHER = None # Posting_Prefetcher created in __main__ if PREFETCH_POSTINGS is set
 STOP_WORDS = set(stopwords.words('english')) 
 
 
@@ -66,7 +86,8 @@ def compute_cosine_similarity(booleanSearchData, query_words, N):
 
 		tf_idf_doc_magnitude = math.sqrt(tf_idf_doc_squared_sum)
 		normalizing_factor = tf_idf_query_magnitude * tf_idf_doc_magnitude
-		cosine_similarity[docid] = tf_idf_prod_weight_sum / normalizing_factor
+		# Terms present in every document have an idf, and so a weight, of 0
+		cosine_similarity[docid] = tf_idf_prod_weight_sum / normalizing_factor if normalizing_factor != 0 else 0
 
 	return cosine_similarity
 
@@ -78,96 +99,175 @@ def tokenize(text):
 	return tokenizer.tokenize(text)
 
 
-def generate_posting_lists(InvIndex_fh, MetaIndex, term):
-	# Generates posting list(s) for the argument: term.
-	# Merges posting lists if more than one exists for the same term.
-	# Yields postings in a single posting list.
+def read_index_lines(InvIndex_fh, MetaIndex, term):
+	# Reads the lines of term from inverted index one after another on the shared file handle
+	lines = []
+	for record_position in sorted(MetaIndex.get(term, [])):
+		with PROFILER.span("posting_io"):
+			InvIndex_fh.seek(record_position) # Moves file pointer to record position
+			line = InvIndex_fh.readline() # Reads a single instance of (Term, PostingList(*))
+		PROFILER.count("bytes_read", len(line))
+		lines.append(line)
+	return lines
+
+
+def prefetch_index_lines(prefetcher, MetaIndex, term):
+	# Starts reading the lines of term on the prefetcher's threads and returns their Futures
+	return [prefetcher.prefetch(record_position) for record_position in sorted(MetaIndex.get(term, []))]
+
+
+def wait_for_index_lines(line_futures):
+	lines = []
+	for line_future in line_futures:
+		# Only the time spent blocked on a read that hasn't finished yet is counted
+		with PROFILER.span("posting_io"):
+			line = line_future.result()
+		PROFILER.count("bytes_read", len(line))
+		lines.append(line)
+	return lines
+
+
+def get_document_frequency(lines):
+	# Sums the df at the head of each inverted index line of a term. Returns 0 for a term without lines.
+	df = 0
+	for line in lines:
+		df += int(re.match(INVERTED_INDEX_DF_PATTERN, line).group("df"))
+	return df
+
+
+def generate_postings(line):
+	# Re-constructs the postings on an inverted index line.
+	# Yields postings one at a time in docid order, decoding each only when it is requested.
 	
 	boolDict = {"True": True, "False": False}
 
-	# Gets the starting positions of term in inverted index file from meta index.
-	try:
-		record_positions = MetaIndex[term]
-	except:
-		# Exception raised if the term does not exist in inverted index
-		raise Exception("Match Not Found")
-
-	for record_position in sorted(record_positions):
-		posting_list = PostingList()
-		# Re-constructs posting list for each line specified by record_position
-		InvIndex_fh.seek(record_position) # Moves file pointer to record position
-		line = InvIndex_fh.readline() # Reads a single instance of (Term, PostingList(*))
+	# Decode time is measured per posting because the consumer runs between yields,
+	# and is recorded once per line when the generator is exhausted or closed.
+	profiling = PROFILER.enabled
+	decode_ns = 0
+	postings_decoded = 0
+	if profiling: decode_start = time.perf_counter_ns()
 
+	try:
 		# Finds matches based on regex patterns.
 		line_match = re.match(INVERTED_INDEX_LINE_PATTERN, line)
 		posting_list_raw = line_match.group("PostingList")
 		posting_list_match = re.match(INVERTED_INDEX_POSTINGLIST_PATTERN, posting_list_raw)
 
-		yield_count = 0
-		for posting_match in re.findall(INVERTED_INDEX_POSTING_PATTERN, posting_list_match.group("postings")):
-			try:
-				yield_count += 1
-				docid = int(posting_match[0])
-				tf =  int(posting_match[1])
-				title =  boolDict[posting_match[2]]
-				heading =  boolDict[posting_match[3]]
-				bold =  boolDict[posting_match[4]]
-				strong =  boolDict[posting_match[5]]
-				italics =  boolDict[posting_match[6]]
-				emphasized =  boolDict[posting_match[7]]
-				termPositions =  [int(tp) for tp in posting_match[8].split(',')]
-				fields = {"title": title, "heading": heading, "bold": bold, "strong":strong, "italics": italics, "emphasized":emphasized}
+		for posting_match in re.finditer(INVERTED_INDEX_POSTING_PATTERN, posting_list_match.group("postings")):
+			posting_match = posting_match.groups()
+			docid = int(posting_match[0])
+			tf =  int(posting_match[1])
+			title =  boolDict[posting_match[2]]
+			heading =  boolDict[posting_match[3]]
+			bold =  boolDict[posting_match[4]]
+			strong =  boolDict[posting_match[5]]
+			italics =  boolDict[posting_match[6]]
+			emphasized =  boolDict[posting_match[7]]
+			anchor =  boolDict[posting_match[8]]
+			# Postings built only from anchor text have no term positions
+			termPositions =  [int(tp) for tp in posting_match[9].split(',') if tp != '']
+			fields = {"title": title, "heading": heading, "bold": bold, "strong":strong, "italics": italics, "emphasized":emphasized, "anchor":anchor}
+
+			new_posting = Posting(docid, tf, fields)
+			new_posting.termPositions = termPositions
+			if profiling:
+				postings_decoded += 1
+				decode_ns += time.perf_counter_ns() - decode_start
+
+			yield new_posting
+			if profiling: decode_start = time.perf_counter_ns()
+
+	finally:
+		if profiling:
+			PROFILER.count("postings_decoded", postings_decoded)
+			PROFILER.add_span("decode", decode_ns)
+
+
+def generate_term_postings(lines):
+	# Yields the postings of a term in docid order.
+	# A term can have more than one line in inverted index, so the lines are merged by docid.
+	return heapq.merge(*[generate_postings(line) for line in lines], key=lambda posting: posting.docid)
+
+
+def get_query_iterator(query, N, stemmer):
+	# Parses query and plans it into a tree of posting list iterators.
+	# Adjacent terms are ANDed. If that matches nothing, the query is retried with adjacent terms ORed,
+	# while explicit ANDs and NOTs still apply.
+	# Returns (query iterator, stemmed terms to score with), or (None, []) if query has no searchable terms.
+	# Raises ValueError if query is malformed.
+
+	index_lines = {} # {stemmed term: its lines in inverted index}, shared by both planning attempts
+	pending_index_lines = {} # {stemmed term: Futures of its lines} for reads still in flight
+
+	def get_term_iterator(term):
+		if term not in index_lines:
+			if term in pending_index_lines:
+				index_lines[term] = wait_for_index_lines(pending_index_lines.pop(term))
+			else:
+				index_lines[term] = read_index_lines(InvIndex_fh, MetaIndex, term)
+		lines = index_lines[term]
+		return Posting_Iterator(term, generate_term_postings(lines), get_document_frequency(lines))
 
-				# Create a new posting to add into the return posting list
-				new_posting = Posting(docid, tf, fields)
-				new_posting.termPositions = termPositions
-				posting_list.append(new_posting)
+	strict_query_tree = normalize_query_tree(parse_query(query), stemmer, STOP_WORDS)
+	if strict_query_tree is None: return None, []
 
-				if yield_count >= RESULT_BATCH_SIZE:
-					yield posting_list
-					posting_list = PostingList()
+	previous_query_tree = None
+	for query_tree in [strict_query_tree, relax_query_tree(strict_query_tree)]:
+		if query_tree == previous_query_tree: break
 
-			except AttributeError:
-				pass
+		if PREFETCHER is not None:
+			# Issue the reads of every query term up front, so the postings of one term are
+			# decoded while the reads of the others are still in flight.
+			for term in set(get_query_words(query_tree)):
+				if term not in index_lines and term not in pending_index_lines:
+					pending_index_lines[term] = prefetch_index_lines(PREFETCHER, MetaIndex, term)
 
-		yield posting_list
+		with PROFILER.span("planning"):
+			query_iterator = build_query_iterator(query_tree, get_term_iterator, N)
+		if query_iterator.docid is not None: break
+		previous_query_tree = query_tree
 
+	return query_iterator, get_positive_terms(query_tree)
 
-def generate_boolean_search_data(query_words):
-	# {stemmed query word: posting list generator object}
-	posting_list_generators = {query_word: generate_posting_lists(InvIndex_fh, MetaIndex, query_word) for query_word in query_words}
 
-	while True:
-		docid_list_backup = [] # Used when 2 or more query terms don't have common docids
-		list_of_docid_lists = []
-		dict_of_posting_lists = {}
-		for query_word in sorted(query_words):
-			try:
-				posting_list = next(posting_list_generators[query_word])
-			except:
-				continue
-			docid_list = [posting.docid for posting in posting_list.posting_list]
-			list_of_docid_lists.append(docid_list)
-			docid_list_backup.extend(docid_list)
-			dict_of_posting_lists[query_word] = posting_list
+def correct_query(query, MetaIndex, suggester, stemmer):
+	# Replaces each word whose stem is not in inverted index with the closest known word.
+	# Operators, stop words and words without a close match are left as they are.
 
+	def correct_word(word_match):
+		word = word_match.group(0)
+		if word in OPERATORS or word.lower() in STOP_WORDS or stemmer.stem(word) in MetaIndex: return word
+		correction = suggester.correct(word)
+		return correction if correction is not None else word
 
-		# Get list of common docids
-		common_docids = set()
-		for docids in list_of_docid_lists:
-			if len(common_docids) == 0: common_docids = set(docids)
-			else: common_docids = common_docids.intersection(set(docids))
-		
-		common_docids = sorted(list(common_docids))
+	return re.sub(r"[a-zA-Z0-9]+", correct_word, query)
 
 
-		if len(common_docids) == 0:
-			if len(docid_list_backup) > RESULT_BATCH_SIZE:
-				common_docids = sorted(list(set(docid_list_backup)))[:RESULT_BATCH_SIZE]
-			else:
-				common_docids = sorted(list(set(docid_list_backup)))
+def get_completer(suggester):
+	# readline completer for the word being typed, offering the highest df words with that prefix first
+	def completer(text, state):
+		completions = suggester.complete(text)
+		return completions[state] if state < len(completions) else None
+	return completer
 
-		yield dict_of_posting_lists, common_docids
+
+def generate_boolean_search_data(query_iterator):
+	# Yields (dict_of_posting_lists, docids) for the next RESULT_BATCH_SIZE documents matching query_iterator.
+	# dict_of_posting_lists = {stemmed query term: PostingList of its postings in those documents}
+	# Documents are matched lazily, so postings are only read and decoded as far as results are requested.
+	# Yields empty batches once all matches have been returned.
+
+	while True:
+		dict_of_posting_lists = {}
+		docids = []
+		while query_iterator is not None and query_iterator.docid is not None and len(docids) < RESULT_BATCH_SIZE:
+			docid = query_iterator.docid
+			docids.append(docid)
+			query_iterator.collect(docid, dict_of_posting_lists)
+			query_iterator.next()
+
+		yield dict_of_posting_lists, docids
 
 
 def get_search_results(DocIndex, terms, docids):
@@ -221,69 +321,109 @@ def rank(booleanSearchData, cosine_similarity):
 				continue
 
 			doc_score = 0
-			# Add one to doc_score if term appears in title, heading, bold, strong, italics, or emphasized.
-			if any(posting.fields.values()):
-				doc_score += 1
+			# Add HTML_FIELD_WEIGHT to doc_score if term appears in title, heading, bold, strong, italics, or emphasized.
+			if any(value for field, value in posting.fields.items() if field != "anchor"):
+				doc_score += HTML_FIELD_WEIGHT
+			# Add ANCHOR_FIELD_WEIGHT to doc_score if term appears in anchor text pointing to the document.
+			if posting.fields["anchor"]:
+				doc_score += ANCHOR_FIELD_WEIGHT
 
 			ranked_docs[docid] = cosine_similarity[docid] + doc_score
 
+	# Documents matched without any scored term, e.g. by "NOT term", go last
+	for docid in booleanSearchData[1]:
+		if docid not in ranked_docs: ranked_docs[docid] = 0
+
 	return [docid for docid, score in sorted(ranked_docs.items(), key = lambda x: x[1], reverse=True)]
 
 
 
 
-def main(InvIndex_fh, MetaIndex, DocIndex, TopResults = 5):
+def main(InvIndex_fh, MetaIndex, DocIndex, suggester=None, TopResults = 5):
 	# total number of documents in inverted index
 	N = len(DocIndex)
 	stemmer = snowball.SnowballStemmer('english')
 
+	if suggester is not None and readline is not None:
+		readline.set_completer(get_completer(suggester))
+		if "libedit" in (readline.__doc__ or ""):
+			readline.parse_and_bind("bind ^I rl_complete") # macOS
+		else:
+			readline.parse_and_bind("tab: complete")
+
 	
 	while True:
 		query = input("\nEnter text to search or '-1' to exit: ")
 		if query == '-1': break
-		start_time = int(round(time.time() * 1000))
-		
-		query_words = tokenize(query)
-		# Creates a new list of non-stopword query tokens
-		filtered_query_words = [q for q in query_words if q not in STOP_WORDS]
-		# Uses stop-word(s) for search if the query only contains stop words like "to be or not to be".
-		if len(filtered_query_words) == 0: filtered_query_words = query_words
-
-		stemmed_query_words = [stemmer.stem(query_word) for query_word in filtered_query_words]
-		if len(stemmed_query_words) > QUERY_THRESHOLD: stemmed_query_words = stemmed_query_words[:QUERY_THRESHOLD]
-
-		stemmed_query_word_set = set(stemmed_query_words)
-
-		boolean_generator = generate_boolean_search_data(stemmed_query_word_set)
+		start_time = time.perf_counter_ns()
+		page = 1
+		PROFILER.start_query(query, page)
+
+		# Misspelled words would otherwise match nothing
+		if suggester is not None:
+			with PROFILER.span("spelling_correction"):
+				corrected_query = correct_query(query, MetaIndex, suggester, stemmer)
+			if corrected_query != query:
+				print(f"Showing results for: {corrected_query}")
+				query = corrected_query
+
+		# Queries support AND, OR, NOT and parentheses, e.g. "machine learning OR (data NOT mining)"
+		try:
+			# Words a result may contain, used to pick display text
+			display_query_words = get_positive_terms(parse_query(query))
+		except ValueError as e:
+			print(e)
+			PROFILER.end_query()
+			continue
+
+		# Planning already reads postings, so it is deferred until the cache misses
+		boolean_generator = None
+		stemmed_query_words = []
 
 		load_next_set_of_data = False
 
 		while True:
-			cache_result = CACHE.get_result(query)
+			with PROFILER.span("cache_lookup"):
+				cache_result = CACHE.get_result(query)
 			if cache_result == None or load_next_set_of_data:
-				booleanSearchData = next(boolean_generator)
-				#search_results = get_search_results(DocIndex, filtered_query_words, booleanSearchData[1])
+				PROFILER.count("cache_misses")
+				if boolean_generator is None:
+					query_iterator, stemmed_query_words = get_query_iterator(query, N, stemmer)
+					boolean_generator = generate_boolean_search_data(query_iterator)
 
-				cosine_similarity = compute_cosine_similarity(booleanSearchData, stemmed_query_words, N)
+				# Includes posting_io and decode which run inside the iterators
+				with PROFILER.span("boolean_search"):
+					booleanSearchData = next(boolean_generator)
+				#search_results = get_search_results(DocIndex, display_query_words, booleanSearchData[1])
 
-				if len(cosine_similarity) == 0: print("End of results")
+				with PROFILER.span("scoring"):
+					cosine_similarity = compute_cosine_similarity(booleanSearchData, stemmed_query_words, N)
 
-				ranked_docids = rank(booleanSearchData, cosine_similarity)
-				CACHE.add_result(query, ranked_docids)
+				if len(booleanSearchData[1]) == 0: print("End of results")
+
+				with PROFILER.span("ranking"):
+					ranked_docids = rank(booleanSearchData, cosine_similarity)
+				with PROFILER.span("cache_update"):
+					CACHE.add_result(query, ranked_docids)
 
 			else:
+				PROFILER.count("cache_hits")
 				ranked_docids = cache_result
 
-			end_time = int(round(time.time() * 1000))
+			end_time = time.perf_counter_ns()
 
-			search_results = get_search_results(DocIndex, filtered_query_words, ranked_docids)
+			with PROFILER.span("result_fetch"):
+				search_results = get_search_results(DocIndex, display_query_words, ranked_docids)
+			PROFILER.end_query()
 			display_search_results(search_results)
-			print(f"Retrieval time: {end_time - start_time} milliseconds")
+			print(f"Retrieval time: {(end_time - start_time) / 1000000:.3f} milliseconds")
 
 			cin = input(f"\nPress enter to see more results for {query}. \nEnter '0' to search something else\nEnter '-1' to quit\n")
 			if cin == '0': break
 			elif cin == '-1': raise SystemExit
-			start_time = int(round(time.time() * 1000)) # Reset start time
+			start_time = time.perf_counter_ns() # Reset start time
+			page += 1
+			PROFILER.start_query(query, page)
 			load_next_set_of_data = True
 
 
@@ -300,6 +440,8 @@ if __name__ == "__main__":
 	# Keep file handle open for reading contents from inverted index.
 	# Inverted index could be too large to load into memory all at once. 
 	InvIndex_fh = open(InvIndexPath, "r")
+	# Reads the posting lists of a query concurrently, each worker thread with its own file handle.
+	if PREFETCH_POSTINGS: PREFETCHER = Posting_Prefetcher(InvIndexPath)
 	# MetaIndex: JSON object with key = term and value = data offset
 	# for each [term, postingList] in the inverted index file.
 	with open(MetaIndexPath, 'r') as fh:
@@ -307,8 +449,16 @@ if __name__ == "__main__":
 	# DocIndex: {key = docID: integer, value = (url: string, doc_path:string)}: JSON Object
 	with open(DocIndexPath, 'r') as fh:
 		DocIndex = json.load(fh)
+	# Suggester: spelling correction and autocomplete, built by Build_Index.py next to the Meta Index
+	try:
+		with open(os.path.join(os.path.dirname(MetaIndexPath), "Suggester.pkl"), 'rb') as fh:
+			suggester = pickle.load(fh)
+	except FileNotFoundError:
+		print("Suggester.pkl not found, spelling correction and autocomplete are disabled")
+		suggester = None
 
-	main(InvIndex_fh, MetaIndex, DocIndex)
+	main(InvIndex_fh, MetaIndex, DocIndex, suggester)
 
 	InvIndex_fh.close()
+	if PREFETCHER is not None: PREFETCHER.close()
 	
\ No newline at end of file
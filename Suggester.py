@@ -0,0 +1,138 @@
+# Author: Shuvam Raj Satyal
+
+import heapq
+from bisect import bisect_left
+
+# Maximum edit distance (insertions, deletions, substitutions and adjacent transpositions) of a spelling correction
+MAX_EDIT_DISTANCE = 2
+# Words up to this length are only corrected within an edit distance of 1. Almost any short word
+# is 2 edits away from hundreds of others, which makes such corrections slow and mostly wrong.
+SHORT_WORD_LENGTH = 4
+# Deletes are only generated from this many leading characters of a word, which bounds the
+# number of deletes per word. Candidates are verified against the full word afterwards.
+PREFIX_LENGTH = 7
+# Only the highest-df words are used for spelling correction, to bound memory
+MAX_SPELLING_TERMS = 20000
+# Number of completions returned by complete()
+MAX_COMPLETIONS = 10
+# Completions for prefixes up to this length are precomputed. Longer prefixes match few enough
+# words that they are ranked on demand.
+COMPLETION_CACHE_PREFIX_LENGTH = 3
+
+
+def generate_deletes_by_distance(word, max_distance):
+	# Yields the sets of strings obtained by deleting exactly 0, 1, ..., max_distance characters from word
+	edges = {word}
+	yield edges
+	for _ in range(max_distance):
+		edges = {edge[:i] + edge[i + 1:] for edge in edges for i in range(len(edge))}
+		yield edges
+
+
+def get_deletes(word, max_distance):
+	# Returns the set of strings obtained by deleting up to max_distance characters from word
+	return set().union(*generate_deletes_by_distance(word, max_distance))
+
+
+def get_edit_distance(word_1, word_2, max_distance):
+	# Optimal string alignment distance between two words.
+	# Returns max_distance + 1 as soon as the distance is known to exceed max_distance.
+
+	if abs(len(word_1) - len(word_2)) > max_distance: return max_distance + 1
+
+	previous_previous_row = None
+	previous_row = list(range(len(word_2) + 1))
+	for i in range(1, len(word_1) + 1):
+		row = [i] + [0] * len(word_2)
+		for j in range(1, len(word_2) + 1):
+			cost = 0 if word_1[i - 1] == word_2[j - 1] else 1
+			row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+			if i > 1 and j > 1 and word_1[i - 1] == word_2[j - 2] and word_1[i - 2] == word_2[j - 1]:
+				row[j] = min(row[j], previous_previous_row[j - 2] + 1)
+		if min(row) > max_distance: return max_distance + 1
+		previous_previous_row, previous_row = previous_row, row
+
+	return previous_row[-1]
+
+
+class Suggester:
+	# Spelling correction and autocomplete over the words of the corpus.
+	# vocabulary is an iterable of (lowercase word, df).
+	def __init__(self, vocabulary):
+		vocabulary = sorted(vocabulary)
+		self.__words = [word for word, df in vocabulary] # Sorted, so prefixes map to ranges
+		self.__dfs = [df for word, df in vocabulary]
+		self.__word_indexes = {word: index for index, word in enumerate(self.__words)}
+
+		words_by_df = sorted(range(len(self.__words)), key=lambda index: self.__dfs[index], reverse=True)
+
+		# Symmetric delete index: {key = delete of a word's prefix: value = list of word indexes}
+		self.__deletes = {}
+		for index in words_by_df[:MAX_SPELLING_TERMS]:
+			for delete in get_deletes(self.__words[index][:PREFIX_LENGTH], MAX_EDIT_DISTANCE):
+				try:
+					self.__deletes[delete].append(index)
+				except KeyError:
+					self.__deletes[delete] = [index]
+
+		# {key = short prefix: value = up to MAX_COMPLETIONS words with that prefix, highest df first}
+		self.__top_completions = {}
+		for index in words_by_df:
+			word = self.__words[index]
+			for length in range(1, min(len(word), COMPLETION_CACHE_PREFIX_LENGTH) + 1):
+				try:
+					completions = self.__top_completions[word[:length]]
+					if len(completions) < MAX_COMPLETIONS: completions.append(word)
+				except KeyError:
+					self.__top_completions[word[:length]] = [word]
+
+	def get_df(self, word):
+		try:
+			return self.__dfs[self.__word_indexes[word.lower()]]
+		except KeyError:
+			return 0
+
+	def correct(self, word):
+		# Returns the closest known word to word, preferring the smallest edit distance and then
+		# the highest df. Returns word itself if it is known, or None if nothing is close enough.
+
+		word = word.lower()
+		if word in self.__word_indexes: return word
+
+		max_distance = 1 if len(word) <= SHORT_WORD_LENGTH else MAX_EDIT_DISTANCE
+		best_candidate = None
+		best_key = None
+		seen = set()
+		# A word within distance d is reached by deleting at most d characters from the query word,
+		# so the search stops as soon as the deletes get longer than the best distance found so far.
+		for delete_distance, deletes in enumerate(generate_deletes_by_distance(word[:PREFIX_LENGTH], max_distance)):
+			if delete_distance > max_distance: break
+			for delete in deletes:
+				for index in self.__deletes.get(delete, ()):
+					if index in seen: continue
+					candidate = self.__words[index]
+					# The distance is at least the number of characters deleted from either side.
+					# The candidate may still be reached through another delete, so it is not marked as seen.
+					if len(candidate[:PREFIX_LENGTH]) - len(delete) > max_distance: continue
+					seen.add(index)
+					if abs(len(candidate) - len(word)) > max_distance: continue
+					distance = get_edit_distance(word, candidate, max_distance)
+					if distance > max_distance: continue
+					key = (distance, -self.__dfs[index])
+					if best_key is None or key < best_key:
+						best_key = key
+						best_candidate = candidate
+						max_distance = distance
+
+		return best_candidate
+
+	def complete(self, prefix, k=MAX_COMPLETIONS):
+		# Returns up to k words starting with prefix, highest df first
+		prefix = prefix.lower()
+		if len(prefix) == 0: return []
+		if len(prefix) <= COMPLETION_CACHE_PREFIX_LENGTH and k <= MAX_COMPLETIONS:
+			return self.__top_completions.get(prefix, [])[:k]
+
+		start = bisect_left(self.__words, prefix)
+		end = bisect_left(self.__words, prefix + chr(0x10FFFF))
+		return [self.__words[index] for index in heapq.nlargest(k, range(start, end), key=lambda index: self.__dfs[index])]